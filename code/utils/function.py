@@ -1,4 +1,5 @@
 import os
+import warnings
 from itertools import product
 from collections import defaultdict
 
@@ -105,6 +106,36 @@ def dropnan(df, min_num=None, thresh=.5, axis=0):
     return df
 
 
+def prune_nan(df, thresh=.5):
+    '''
+    Drop constant rows and rows below the completeness threshold in one
+    pass over the nan mask, equivalent to delete_nan_array + dropnan
+    '''
+    arr = df.values
+    counts = arr.shape[1] - np.isnan(arr).sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        keep = (np.nanmax(arr, axis=1) != np.nanmin(arr, axis=1)) & (
+            counts >= math.ceil(thresh * arr.shape[1]))
+    if keep.all():
+        return df
+    return df.loc[keep]
+
+
+def dropnan_columns(df):
+    '''
+    Drop all-nan columns through one numpy reduction, returning the
+    frame untouched when it is already dense
+    '''
+    arr = df.values
+    if arr.dtype.kind == 'f':
+        keep = ~np.isnan(arr).all(axis=0)
+        if keep.all():
+            return df
+        return df.iloc[:, keep]
+    return df.dropna(how='all', axis=1)
+
+
 def dateset_preprocess_for_statistic(df, prestatistic_method=None):
     prestatistic_methods = {'log2': np.log2, 'log10': np.log10}
     if isinstance(df, (pd.Series, pd.DataFrame)):
@@ -1,15 +1,17 @@
 import os
-import glob
-import sys
+import re
+import math
+import warnings
 from copy import copy
-from itertools import product
-from functools import reduce
+from itertools import chain, product
 from collections import Iterable, defaultdict
 
 import numpy as np
 import pandas as pd
 
 import scipy.stats
+import patsy
+from joblib import Parallel, delayed
 import statsmodels.formula.api as smf
 from statsmodels.stats.anova import anova_lm
 from statsmodels.stats.outliers_influence import variance_inflation_factor
@@ -17,9 +19,9 @@ from statsmodels.stats.outliers_influence import variance_inflation_factor
 from sklearn.preprocessing import MinMaxScaler, StandardScaler, Normalizer, RobustScaler
 import gseapy as gp
 
-from .statistic import fdr, core_corr, core_corr_tensor, ranksums_vectorized, f_oneway_vectorized, pearson_pvalue, spearman_pvalue
+from .statistic import fdr_vectorized, parallel_rows, nanmedian, core_corr, core_corr_tensor, pairwise_pearson_nan, ttest_ind_vectorized, f_oneway_vectorized, pearson_pvalue, spearman_pvalue, group_stats_kernel, group_quantile_mask
 from .algorithm import core_PCA, core_tSNE, core_UMAP
-from .function import percentage, dropnan, handle_colors, sort_custom, ora, filter_by_quantile
+from .function import dropnan, prune_nan, dropnan_columns, handle_colors, sort_custom, ora
 from .exceptions import MethodError
 from .eplot.core import scatterplot, barplot, cateplot, heatmap
 from .eplot.base import savefig, confidence_ellipse
@@ -27,6 +29,37 @@ from .eplot.constants import MCMAP, R_CMAP
 from .eplot.plot_func import volcanoplot
 
 
+def _concat_series_inner(series_list):
+    '''
+    Align series on their shared index with one intersection pass instead
+    of the pairwise joins pd.concat(axis=1, join='inner') performs
+    '''
+    common = series_list[0].index
+    for series in series_list[1:]:
+        common = common.intersection(series.index)
+    return pd.DataFrame(
+        {series.name: series.reindex(common).to_numpy() for series in series_list},
+        index=common)
+
+
+_SIG_COLUMNS_PATTERN = re.compile('pvalues|fdr')
+_BUBBLE_SIG_COLUMNS_PATTERN = re.compile('pvalue|fdr|FDR|qvalue|adjust|p-val|p_value')
+
+
+class _LazyData(dict):
+    '''
+    Loaded datasets keyed by omic name, reading missing ones on first access
+    '''
+
+    def __init__(self, loader):
+        super().__init__()
+        self._loader = loader
+
+    def __missing__(self, key):
+        self._loader(key)
+        return dict.__getitem__(self, key)
+
+
 class Dataset:
     '''
     pass
@@ -36,33 +69,39 @@ class Dataset:
         '''
         Initialize variables for the dataset object
         '''
-        
+
         self._dirpath = dirpath
 
         if not os.path.isdir(os.path.join(dirpath, 'document')):
             FileNotFoundError("The document file is not exist")
 
         self.__object_name = os.path.split(os.path.abspath(self._dirpath))[-1]
-        self._data = {}
+        self._data = _LazyData(self._get_dataframe)
         self._valid_dfs_names = []
-        self._color_map = {}
-        omic_names = [
-            f.split('.', -1)[0] for f in os.listdir(os.path.join(self._dirpath, 'document'))]
-        self._load_dataset(omic_names)
+        self.__color_map = None
+        self._global_min_cache = {}
+        self._build_file_index()
         self._initialized = True
 
+    def _build_file_index(self):
+        '''
+        Snapshot the document directory once as a {stem: path} mapping
+        '''
+        document_path = os.path.join(self._dirpath, 'document')
+        self._file_index = {}
+        for f in os.listdir(document_path):
+            self._file_index.setdefault(
+                f.split('.', 1)[0], os.path.join(document_path, f))
+
     def _get_df_path(self, omic_name):
         '''
         Get the absolute path for a dataset
         '''
         try:
-            dataset_path = glob.glob(
-                os.path.join(self._dirpath, 'document', omic_name + '.*'))[0]
-        except:
+            return self._file_index[omic_name]
+        except KeyError:
             raise ValueError('Please check your name parameter.')
 
-        return dataset_path
-
     def _get_dataframe(self, omic_name):
         '''
         Get the specific omic dataset
@@ -79,16 +118,22 @@ class Dataset:
             index_col = [0]
 
         if omic_path.endswith('.csv'):
-            df = pd.read_csv(omic_path, index_col=index_col)
+            try:
+                df = pd.read_csv(omic_path, index_col=index_col, engine='pyarrow')
+            except (ImportError, ValueError):
+                df = pd.read_csv(omic_path, index_col=index_col)
 
         elif omic_path.endswith(('.txt', 'tsv', 'maf')):
-            df = pd.read_table(omic_path, index_col=index_col)
+            try:
+                df = pd.read_table(omic_path, index_col=index_col, engine='pyarrow')
+            except (ImportError, ValueError):
+                df = pd.read_table(omic_path, index_col=index_col)
 
         else:
             if omic_path.endswith('.pickle'):
                 df = pd.read_pickle(omic_path)
             elif omic_path.endswith('.feather'):
-                df = pd.read_feather(omic_path)
+                df = pd.read_feather(omic_path, use_threads=True)
             else:
                 raise ValueError(
                     "dataset file type should be one of csv, tsv, txt, pickle, feather, please check your file type."
@@ -97,32 +142,60 @@ class Dataset:
 
         df.name = omic_name
         self._data[omic_name] = df
+        self._global_min_cache.pop(omic_name, None)
+        # frames derived from the previous load are stale after a reload
+        getattr(self, '_merge_cache', {}).clear()
+        self.__dict__.pop('_masked_dataset_cache', None)
 
         if not omic_name in self._valid_dfs_names:
             self._valid_dfs_names.append(omic_name)
 
     def _load_dataset(self, names):
+        '''
+        Explicitly prefetch datasets; loading is otherwise lazy
+        '''
         for omic_name in names:
             try:
                 self._get_dataframe(omic_name)
             except:
                 continue
         if 'color' in names:
-            self._color_map = handle_colors(
-                self._data['color'], self._data['category'])
+            self.__color_map = None
+
+    @property
+    def _color_map(self):
+        if self.__color_map is None:
+            if 'color' in self._file_index:
+                self.__color_map = handle_colors(
+                    self._data['color'], self._data['category'])
+            else:
+                self.__color_map = {}
+        return self.__color_map
 
     def update(self, *name):
+        self._build_file_index()
         if not name or 'all' in name:
-            name = [
-                f.split('.', -1)[0] for f in os.listdir(os.path.join(self._dirpath, 'document'))]
+            name = list(self._file_index)
         self._load_dataset(name)
 
+    def _get_global_min(self, omic_name):
+        '''
+        Cache the global minimum of a dataset, it is static per load
+        '''
+        if omic_name not in self._global_min_cache:
+            self._global_min_cache[omic_name] = np.nanmin(
+                self._data[omic_name].values)
+        return self._global_min_cache[omic_name]
+
     @staticmethod
     def delete_nan_array(df, axis=1):
-        if df.max(axis=axis).nunique() != 1:
-            return df[df.max(axis=axis) != df.min(axis=axis)]
-        else:
+        arr = df.values
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            keep = np.nanmax(arr, axis=axis) != np.nanmin(arr, axis=axis)
+        if keep.all():
             return df
+        return df.loc[keep] if axis == 1 else df.loc[:, keep]
 
     def write_table(self,
                     matrix,
@@ -162,14 +235,20 @@ class Dataset:
                         if any(np.setdiff1d(np.unique(j), np.unique(group_file[i].unique()))):
                             raise ValueError('{0} with wrong elements, please check the part_element parameter'.format(j))
                     part_element_use = list(product(*part_element))
-                group_file = group_file.loc[np.isin(group_file.values, part_element_use).all(axis=1)].pipe(sort_custom, group_name, part_element)
+                else:
+                    part_element_use = part_element
+                allowed = set(part_element_use)
+                keep = [tuple(row) in allowed for row in group_file.values]
+                group_file = group_file.loc[keep].pipe(sort_custom, group_name, part_element)
             else:
-                group_file = group_file.loc[np.isin(group_file.values, part_element)].pipe(sort_custom, group_name, part_element)
+                group_file = group_file.loc[group_file.isin(part_element)].pipe(sort_custom, group_name, part_element)
         return group_file
 
     def __getattr__(self, __name):
         if __name in self._data:
             return self._data[__name]
+        elif not __name.startswith('_') and __name in self._file_index:
+            return self._data[__name]
         else:
             return object.__getattribute__(self, __name)
 
@@ -203,19 +282,34 @@ class Preprocessing(Dataset):
             return pd.DataFrame(scaler().fit_transform(df), index=df.index, columns=df.columns)
 
     def calculate_vif(self, df, thresh=5):
-        drop = True
         df = df.assign(add_const=1)
-        while drop:
-            variables = df.columns
-            vif = np.array([variance_inflation_factor(df, i) for i in range(df.shape[1])])[:-1]
-            max_vif = np.max(vif)
-            if max_vif > thresh:
-                max_loc = np.argmax(max_vif)
-                print(f"Dropping {df.columns[max_loc]} with vif={max_vif}")
-                df = df.drop(variables[max_loc], axis=1)
-            else:
-                drop = False
-        return df.drop('add_const', axis=1)
+        X = df.values.astype(float)
+        try:
+            gram_inv = np.linalg.inv(X.T @ X)
+        except np.linalg.LinAlgError:
+            # exactly collinear predictors leave X'X singular; the pinv-backed
+            # statsmodels VIFs report them as inf so the loop can drop them
+            while df.shape[1] > 1:
+                vif = np.array([variance_inflation_factor(df, i) for i in range(df.shape[1])])[:-1]
+                max_loc = int(np.argmax(vif))
+                if vif[max_loc] <= thresh:
+                    break
+                print(f"Dropping {df.columns[max_loc]} with vif={vif[max_loc]}")
+                df = df.drop(df.columns[max_loc], axis=1)
+            return df.drop('add_const', axis=1)
+        tss = ((X - X.mean(axis=0)) ** 2).sum(axis=0)
+        keep = np.arange(df.shape[1])
+        while len(keep) > 1:
+            vif = (gram_inv.diagonal() * tss[keep])[:-1]
+            max_loc = int(np.argmax(vif))
+            if vif[max_loc] <= thresh:
+                break
+            print(f"Dropping {df.columns[keep[max_loc]]} with vif={vif[max_loc]}")
+            rest = np.delete(np.arange(len(keep)), max_loc)
+            gram_inv = gram_inv[np.ix_(rest, rest)] - np.outer(
+                gram_inv[rest, max_loc], gram_inv[max_loc, rest]) / gram_inv[max_loc, max_loc]
+            keep = keep[rest]
+        return df.iloc[:, keep[:-1]]
 
 class Group(Preprocessing):
     def __init__(self,
@@ -250,6 +344,8 @@ class Group(Preprocessing):
         self._group_check_params()
 
     def _group_check_params(self):
+        # any group parameter change invalidates the merged plot frames
+        self._merge_cache = {}
         if self._group_name and self._file_type and self._dataset_type:
             if any(np.setdiff1d(self._group_name, self._data[self._file_type].columns)):
                 raise ValueError(
@@ -266,16 +362,38 @@ class Group(Preprocessing):
         if isinstance(self._group_file, pd.Series):
             self._group_file = self._group_file.to_frame()
 
-        self._tmp_dataset = self._data[self._dataset_type].reindex(
-            self._group_file.index,
-            axis=1).dropna(axis=1, how='all').pipe(self.delete_nan_array).pipe(dropnan, thresh=self._thresh)
-        self._group_file = self._group_file.loc[self._tmp_dataset.columns].apply(lambda x: '_'.join(x.astype(str)), axis=1)
+        pre_dataset = self._data[self._dataset_type].reindex(
+            self._group_file.index, axis=1)
+        # single nan-mask pass replaces the dropna/delete_nan_array/dropnan
+        # chain, which rescanned the matrix once per filter
+        arr = pre_dataset.values
+        nan_mask = np.isnan(arr)
+        col_keep = ~nan_mask.all(axis=0)
+        row_count = (~nan_mask[:, col_keep]).sum(axis=1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            row_keep = (np.nanmax(arr, axis=1) != np.nanmin(arr, axis=1)) & (
+                row_count >= math.ceil(self._thresh * col_keep.sum()))
+        # reindexing along columns leaves a strided block behind; rebuild the
+        # matrix row-major so every axis=1 reduction walks unit-stride memory
+        self._tmp_dataset = pd.DataFrame(
+            np.ascontiguousarray(arr[np.ix_(row_keep, col_keep)]),
+            index=pre_dataset.index[row_keep],
+            columns=pre_dataset.columns[col_keep])
+        self._tmp_dataset_min = np.nanmin(self._tmp_dataset.values)
+        group_file = self._group_file.loc[self._tmp_dataset.columns].astype(str)
+        if group_file.shape[1] == 1:
+            self._group_file = group_file.iloc[:, 0]
+        else:
+            self._group_file = group_file.iloc[:, 0].str.cat(group_file.iloc[:, 1:], sep='_')
         # if self._part_element and not isinstance(self._group_name, str) and not isinstance(self._part_element[0], tuple):
         self._part_element = pd.unique(self._group_file).tolist()
 
         tmp = {
-            name: self._tmp_dataset.reindex(group.index,
-                                            axis=1).dropna(axis=1, how='all').values
+            name: np.ascontiguousarray(
+                self._tmp_dataset.reindex(group.index,
+                                          axis=1).dropna(axis=1, how='all').values,
+                dtype=np.float64)
             for name, group in self._group_file.groupby(self._group_file, sort=False)
         }
 
@@ -317,32 +435,56 @@ class Group(Preprocessing):
                     palette = dict(zip(self._part_element, palette))
                 self._palette = {}
                 for i in self._part_element:
+                    if i in palette:
+                        self._palette[i] = palette[i]
+                        continue
                     for k, v in palette.items():
-                        if k == i:
+                        if k in i:
                             self._palette[i] = v
-                        elif k in i:
-                            if k in self._palette.keys():
-                                continue
-                            else:
-                                self._palette[i] = v             
-                if self._part_element:
-                    self._palette = {k: v for k, v in self._palette.items() if k in self._part_element}
-                else:
+                if not self._part_element:
                     self._part_element = pivot_group_name
             else:
                 self._palette = {k: MCMAP[i] for i, k in enumerate(self._part_element)}
 
     def __group_cal_values(self):
-        mean_value = np.array(
-            list(map(lambda x: np.nanmean(x, axis=1), self.__group)))
-        median_value = np.array(
-            list(map(lambda x: np.nanmedian(x, axis=1), self.__group)))
-        std_value = np.array(
-            list(map(lambda x: np.nanstd(x, axis=1, ddof=1), self.__group)))
-        count_value = np.array(
-            list(map(lambda x: np.count_nonzero(~np.isnan(x), axis=1), self._Group__group)))
-        percentage_value = np.array(
-            list(map(lambda x: percentage(x, axis=1), self.__group)))
+        if group_stats_kernel is not None:
+            labels = pd.Categorical(
+                self._group_file, categories=self._group_values).codes.astype(np.int32)
+            count_value, mean_value, std_value = group_stats_kernel(
+                self._tmp_dataset.values, labels, len(self._group_values))
+            median_value = np.asarray(
+                [nanmedian(group, axis=1) for group in self.__group])
+            percentage_value = count_value / np.array(
+                [group.shape[1] for group in self.__group])[:, None]
+            self.__group_masks = [
+                ~np.isnan(group) for group in self.__group
+            ] if len(self._group_values) == 2 else None
+        else:
+            mean_value = []
+            median_value = []
+            std_value = []
+            count_value = []
+            percentage_value = []
+            self.__group_masks = []
+            for group in self.__group:
+                mask = ~np.isnan(group)
+                self.__group_masks.append(mask)
+                count = mask.sum(axis=1)
+                value_sum = np.where(mask, group, 0).sum(axis=1)
+                square_sum = np.where(mask, group * group, 0).sum(axis=1)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mean = value_sum / count
+                    std = np.sqrt((square_sum - value_sum * mean) / (count - 1))
+                mean_value.append(mean)
+                median_value.append(nanmedian(group, axis=1))
+                std_value.append(std)
+                count_value.append(count)
+                percentage_value.append(count / group.shape[1])
+            mean_value = np.asarray(mean_value)
+            median_value = np.asarray(median_value)
+            std_value = np.asarray(std_value)
+            count_value = np.asarray(count_value)
+            percentage_value = np.asarray(percentage_value)
         cv_value = std_value / mean_value
 
         if len(self._group_values) == 1:
@@ -366,7 +508,7 @@ class Group(Preprocessing):
         statistic_methods = {'log2': np.log2, 'log10': np.log10}
 
         if self._statistic_method in statistic_methods.keys(
-        ) and self._tmp_dataset.min().min() > 0:
+        ) and self._tmp_dataset_min > 0:
             statistic_data = list(
                 map(
                     lambda x: statistic_methods[self._statistic_method]
@@ -379,11 +521,18 @@ class Group(Preprocessing):
     def __two_groups_cal_statistic_prob(self, count=None):
         statistic_data = self.__dateset_preprocess_for_statistic()
 
-        ttest_statistic, ttest_pvalues = np.asarray(scipy.stats.ttest_ind(*statistic_data, axis=1, equal_var=True, nan_policy='omit', **self._ttest_kwargs))
-        # ttest_pvalues = np.asarray(scipy.stats.ttest_ind(*statistic_data, axis=1, equal_var=True, nan_policy='omit')[1])
-        adjust_ttest_pvalues = fdr(ttest_pvalues, self._fdr_method)[1]
-        ranksums_statistic, ranksums_pvalues = ranksums_vectorized(statistic_data[0], statistic_data[1])
-        adjust_ranksums_pvalues = fdr(ranksums_pvalues.copy(), self._fdr_method)[1]
+        if self._ttest_kwargs:
+            ttest_statistic, ttest_pvalues = np.asarray(scipy.stats.ttest_ind(*statistic_data, axis=1, equal_var=True, nan_policy='omit', **self._ttest_kwargs))
+        else:
+            # the log transform never introduces NaN here (only applied when
+            # the dataset minimum is positive), so the masks computed in
+            # __group_cal_values stay valid for the transformed data
+            masks = self.__group_masks or [None, None]
+            ttest_statistic, ttest_pvalues = ttest_ind_vectorized(
+                *statistic_data, mask_x=masks[0], mask_y=masks[1])
+        ranksums_statistic, ranksums_pvalues = np.asarray(scipy.stats.ranksums(statistic_data[0], statistic_data[1], axis=1, nan_policy='omit'))
+        adjust_ttest_pvalues, adjust_ranksums_pvalues = fdr_vectorized(
+            np.vstack((ttest_pvalues, ranksums_pvalues)), self._fdr_method)
         if isinstance(count, np.ndarray):
             cohen_d = ttest_statistic * np.sqrt(1 / count[0] + 1 / count[1])
             wilcoxon_es = ranksums_statistic / np.sqrt(count.sum(axis=0))
@@ -394,15 +543,13 @@ class Group(Preprocessing):
 
     def __multi_groups_cal_statistic_prob(self):
         statistic_data = self.__dateset_preprocess_for_statistic()
-        # anova_statistics, anova_pvalues = f_oneway_vectorized(*statistic_data, axis=1)
-        anova_statistics, anova_pvalues = scipy.stats.f_oneway(*statistic_data, axis=1, nan_policy='omit')
-        adjust_anova_pvalues = fdr(anova_pvalues, self._fdr_method)[1]
-        res = scipy.stats.alexandergovern(*statistic_data, axis=1, nan_policy='omit')
-        alexandergovern_statistics = res.statistic
-        alexandergovern_pvalues = res.pvalue
-        adjust_alexandergovern_pvalues = fdr(alexandergovern_pvalues, self._fdr_method)[1]
-        kruskal_statistics, kruskal_pvalues = np.asarray(scipy.stats.kruskal(*statistic_data, axis=1, nan_policy='omit'))
-        adjust_kruskal_pvalues = fdr(kruskal_pvalues, self._fdr_method)[1]
+        anova_statistics, anova_pvalues = f_oneway_vectorized(*statistic_data, axis=1)
+        alexandergovern_statistics, alexandergovern_pvalues = parallel_rows(
+            lambda *groups: scipy.stats.alexandergovern(*groups, axis=1, nan_policy='omit'), statistic_data)
+        kruskal_statistics, kruskal_pvalues = parallel_rows(
+            lambda *groups: scipy.stats.kruskal(*groups, axis=1, nan_policy='omit'), statistic_data)
+        adjust_anova_pvalues, adjust_alexandergovern_pvalues, adjust_kruskal_pvalues = fdr_vectorized(
+            np.vstack((anova_pvalues, alexandergovern_pvalues, kruskal_pvalues)), self._fdr_method)
 
         return anova_statistics, anova_pvalues, adjust_anova_pvalues, alexandergovern_statistics, alexandergovern_pvalues, adjust_alexandergovern_pvalues, kruskal_statistics, kruskal_pvalues, adjust_kruskal_pvalues
 
@@ -433,10 +580,10 @@ class Group(Preprocessing):
                 group_values[0] + '_percentage',
                 group_values[1] + '_percentage',
             ]
-            self._group_table = pd.DataFrame(np.vstack(
-                (tmp_param_values, ratio,
-                 self.__param_values['inference_statistics'],
-                 self.__param_values['percentage'])).transpose(),
+            self._group_table = pd.DataFrame(np.column_stack(
+                (*tmp_param_values, ratio,
+                 *self.__param_values['inference_statistics'],
+                 *self.__param_values['percentage'])),
                 index=self._tmp_dataset.index,
                 columns=table_columns)
             if self._change:
@@ -458,9 +605,10 @@ class Group(Preprocessing):
                 '_'.join((label, 'percentage'))
                 for label in group_values
             ])
-            self._group_table = pd.DataFrame(np.vstack(
-                (tmp_param_values, self.__param_values['inference_statistics'],
-                 self.__param_values['percentage'])).transpose(),
+            self._group_table = pd.DataFrame(np.column_stack(
+                (*tmp_param_values,
+                 *self.__param_values['inference_statistics'],
+                 *self.__param_values['percentage'])),
                 index=self._tmp_dataset.index,
                 columns=table_columns)
 
@@ -489,6 +637,22 @@ class Group(Preprocessing):
         if isinstance(group_name, str):
             group_name = [group_name]
             
+        cache_key = None
+        if not shuffle:
+            # data_element often arrives as an Index or array straight from a
+            # table query; flatten any non-string iterable into a tuple so
+            # the key stays hashable
+            freeze = lambda value: tuple(value) if np.iterable(value) and not isinstance(value, str) else value
+            try:
+                cache_key = (freeze(data_element), freeze(group_name), freeze(data_type),
+                             freeze(part_element), join_method, sort, freeze(sort_group), ascending)
+                cached = self._merge_cache.get(cache_key)
+            except TypeError:
+                cache_key = None
+                cached = None
+            if cached is not None:
+                return cached.copy(deep=False)
+
         group_name_df = self._data[self._file_type].loc[:, group_name].dropna(how='all').loc[self._group_file.index]
         if not part_element:
             part_element = self._part_element
@@ -498,11 +662,19 @@ class Group(Preprocessing):
 
         columns_name = self._tmp_dataset.index.name
         if data_type:
-            data = pd.DataFrame(columns=group_name_df.index)
+            # the seed frame keeps the inner join anchored on the group samples
+            parts = [pd.DataFrame(columns=group_name_df.index)]
+            data_element_index = pd.Index(data_element)
             for dt in data_type:
-                add_df = self._data[dt].reindex(self._tmp_dataset.columns, axis=1).dropna(how='all', axis=1).reindex(data_element).dropna(how='all')
+                add_df = self._data[dt]
+                # intersect labels up front instead of reindexing to missing
+                # ones and dropping the nan fill again
+                rows = data_element_index.intersection(add_df.index, sort=False)
+                cols = self._tmp_dataset.columns.intersection(add_df.columns)
+                add_df = add_df.loc[rows, cols].dropna(how='all').dropna(how='all', axis=1)
                 add_df.index = add_df.index + '|' + dt
-                data = pd.concat([data, add_df], join=join_method)
+                parts.append(add_df)
+            data = pd.concat(parts, join=join_method)
             if sort.startswith('el'):
                 data.index = pd.MultiIndex.from_tuples(data.index.str.split('|', n=-1).tolist())
                 data = data.loc[data_element]
@@ -519,6 +691,11 @@ class Group(Preprocessing):
         # else:
         #     data = data.sort_values(by=sort_group, axis=0, ascending=ascending)
         data.columns.name = columns_name
+        if cache_key is not None:
+            if len(self._merge_cache) >= 64:
+                self._merge_cache.clear()
+            self._merge_cache[cache_key] = data
+            return data.copy(deep=False)
         return data
 
     def decomposition(self,
@@ -621,6 +798,8 @@ class Correlation(Preprocessing):
                  fdr_type='local',
                  algorithm='all',
                  write_out=False,
+                 device='cpu',
+                 dtype='float32',
                  *args,
                  **kwargs):
         super().__init__(dirpath)
@@ -637,6 +816,8 @@ class Correlation(Preprocessing):
         self._corr_fdr_method = fdr_method
         self._corr_fdr_type = fdr_type
         self._corr_algorithm = algorithm
+        self._corr_device = device
+        self._corr_dtype = dtype
         self._write_out = write_out
 
         self._corr_check_params()
@@ -662,19 +843,49 @@ class Correlation(Preprocessing):
         else:
             corr_name = algorithm + '_corr'
 
+        # float32 halves the bandwidth of the mask scans and lets the matmul
+        # dispatch to SGEMM; the copy also keeps the zero-fill below from
+        # mutating the caller's matrices
+        self_corr = matrix2_value is None or matrix2_value is matrix1_value
+        matrix1_value = np.ascontiguousarray(matrix1_value, dtype=self._corr_dtype)
+        if self_corr:
+            matrix2_value = matrix1_value
+        else:
+            matrix2_value = np.ascontiguousarray(matrix2_value, dtype=self._corr_dtype)
+
         if all((len(self._handle_element1)>1, len(self._handle_element2)>1, not self._corr_cal_type.startswith('co'))):
-            matrix1_value[matrix1_value!=matrix1_value] = 0
-            matrix2_value[matrix2_value!=matrix2_value] = 0
-            dof, corr = core_corr_tensor(matrix1_value, matrix2_value, method=algorithm)
-        
+            if algorithm == 'pearson' and self_corr and not self._corr_has_nan:
+                # symmetric case: corrcoef centers in place and lets BLAS use
+                # the symmetric-rank-update kernel instead of a full GEMM
+                corr = np.corrcoef(matrix1_value)
+                dof = np.array([matrix1_value.shape[1] / 2 - 1])
+            elif algorithm == 'pearson' and pairwise_pearson_nan is not None and self._corr_has_nan:
+                # accumulate only pairwise-finite positions instead of
+                # zero-filling the nans before the GEMM
+                corr, count = pairwise_pearson_nan(matrix1_value, matrix2_value)
+                dof = count / 2 - 1
+            else:
+                if self._corr_has_nan:
+                    matrix1_value[matrix1_value!=matrix1_value] = 0
+                    matrix2_value[matrix2_value!=matrix2_value] = 0
+                if algorithm == 'spearman':
+                    # the matrices are nan-free after the fill, so rank them
+                    # in one vectorized pass and skip the masked path inside
+                    dof, corr = core_corr_tensor(
+                        scipy.stats.rankdata(matrix1_value, axis=1),
+                        scipy.stats.rankdata(matrix2_value, axis=1),
+                        method=algorithm, ranked=True, device=self._corr_device)
+                else:
+                    dof, corr = core_corr_tensor(matrix1_value, matrix2_value, method=algorithm, device=self._corr_device)
+
         else:
             count, dof, corr = core_corr(matrix1_value, matrix2_value, method=algorithm)
             self._corr_value['count'] = self._corr_value.get('count', count)
             if self._corr_cal_type.startswith('co'):
-                self._corr_value['frequence_'+self._corr_name1] = self._corr_value.get('frequence_'+self._corr_name1, count / np.count_nonzero(~np.isnan(matrix1_value), axis=1))
-                self._corr_value['frequence_'+self._corr_name2] = self._corr_value.get('frequence_'+self._corr_name2, count / np.count_nonzero(~np.isnan(matrix2_value), axis=1))
+                self._corr_value['frequence_'+self._corr_name1] = self._corr_value.get('frequence_'+self._corr_name1, count / (matrix1_value.shape[1] - np.isnan(matrix1_value).sum(axis=1)))
+                self._corr_value['frequence_'+self._corr_name2] = self._corr_value.get('frequence_'+self._corr_name2, count / (matrix2_value.shape[1] - np.isnan(matrix2_value).sum(axis=1)))
             else:
-                self._corr_value['frequence'] = self._corr_value.get('frequence', count / np.count_nonzero(~np.isnan(matrix1_value), axis=1))
+                self._corr_value['frequence'] = self._corr_value.get('frequence', count / (matrix1_value.shape[1] - np.isnan(matrix1_value).sum(axis=1)))
             self._corr_index = self._corr_value['frequence'] > self._corr_thresh
 
         self._corr_value[corr_name] = corr
@@ -685,16 +896,18 @@ class Correlation(Preprocessing):
             prob = pearson_pvalue(corr, dof)
 
         self._corr_value[algorithm+'_pvalues'] = prob
-        if self._corr_fdr_type == 'global':
-            prob = prob.faltten()
-        if prob.ndim == 1:
-            prob = prob[None, :]
-        # self._corr_value['count'] = self._corr_value.get('count', count)
-        fdr_ = np.apply_along_axis(
-            fdr, 1, prob, method=self._corr_fdr_method)[:, 1][0]   # non corresponding FDR not solved
+        if self._corr_fdr_type == 'global' and prob.ndim > 1:
+            fdr_ = fdr_vectorized(
+                prob.ravel(), method=self._corr_fdr_method).reshape(prob.shape)
+        else:
+            fdr_ = fdr_vectorized(prob, method=self._corr_fdr_method, axis=-1)
         self._corr_value[algorithm+'_fdr'] = fdr_
 
     def __cal_cor_value(self, matrix1_value, matrix2_value):
+        # one scan decides every later nan branch: clean matrices skip the
+        # zero fill entirely, nan-bearing pearson goes to the numba kernel
+        self._corr_has_nan = bool(np.isnan(matrix1_value).any() or (
+            matrix2_value is not None and np.isnan(matrix2_value).any()))
         if 'spearman' in self._corr_algorithm.lower() or 'all' == self._corr_algorithm.lower():  # 输入参数时做'all'替换
             self.__corr_func('spearman', matrix1_value, matrix2_value)
         if 'pearson' in self._corr_algorithm.lower() or 'all' == self._corr_algorithm.lower():
@@ -723,28 +936,46 @@ class Correlation(Preprocessing):
         if min(len(pre_element1), len(pre_element2)) == 1:
             pre_omic1_dataset = self._data[self._corr_name1].loc[pre_element1].dropna(how='all', axis=1)
             self._corr_columns = np.intersect1d(omic_group_name_id, pre_omic1_dataset.columns)
-            pre_omic2_dataset = self.delete_nan_array(self._data[self._corr_name2].loc[pre_element2].reindex(self._corr_columns, axis=1).dropna(how='all', axis=1)).pipe(dropnan, thresh=self._corr_thresh, min_num=False)
+            pre_omic2_dataset = prune_nan(self._data[self._corr_name2].loc[pre_element2].reindex(self._corr_columns, axis=1).dropna(how='all', axis=1), thresh=self._corr_thresh)
             self._corr_columns = np.intersect1d(self._corr_columns, pre_omic2_dataset.columns)
-            pre_omic1_dataset = pre_omic1_dataset.loc[:, self._corr_columns]
+            self._handle_element1 = pre_omic1_dataset.index
+            self._handle_element2 = pre_omic2_dataset.index
+            # gather the shared columns positionally instead of building
+            # another label-indexed frame
+            matrix1_value = pre_omic1_dataset.values[
+                :, pre_omic1_dataset.columns.get_indexer(self._corr_columns)]
+            matrix2_value = pre_omic2_dataset.values
         # for corresponding correlation
         else:
-            self._corr_columns = reduce(np.intersect1d, (self._data[self._corr_name1].columns, self._data[self._corr_name2].columns, omic_group_name_id))
-            pre_omic1_dataset = self.delete_nan_array(self._data[self._corr_name1].loc[pre_element1, self._corr_columns]).pipe(dropnan, thresh=self._corr_thresh, min_num=False)
-            pre_omic2_dataset = self.delete_nan_array(self._data[self._corr_name2].loc[pre_element2, self._corr_columns]).pipe(dropnan, thresh=self._corr_thresh, min_num=False)
+            self._corr_columns = self._data[self._corr_name1].columns.intersection(
+                self._data[self._corr_name2].columns).intersection(omic_group_name_id)
+            pre_omic1_dataset = prune_nan(self._data[self._corr_name1].loc[pre_element1, self._corr_columns], thresh=self._corr_thresh)
+            if self._corr_name1 == self._corr_name2 and list(pre_element1) == list(pre_element2):
+                # correlating a dataset against itself: share the pruned
+                # frame so __corr_func sees one array and can take the
+                # symmetric corrcoef path
+                pre_omic2_dataset = pre_omic1_dataset
+            else:
+                pre_omic2_dataset = prune_nan(self._data[self._corr_name2].loc[pre_element2, self._corr_columns], thresh=self._corr_thresh)
 
             if self._corr_cal_type.startswith('co'):
                 self._handle_element1 = self._handle_element2 = pre_omic1_dataset.index.intersection(pre_omic2_dataset.index)
                 if len(self._handle_element1) == 0:
                     raise ValueError('{} and {} has not overlapped index'.format(
                         self._corr_name1, self._corr_name2))
-                
-                pre_omic1_dataset = pre_omic1_dataset.loc[self._handle_element1]
-                pre_omic2_dataset = pre_omic2_dataset.loc[self._handle_element2]
 
-        self._handle_element1 = pre_omic1_dataset.index
-        self._handle_element2 = pre_omic2_dataset.index
+                matrix1_value = pre_omic1_dataset.values[
+                    pre_omic1_dataset.index.get_indexer(self._handle_element1)]
+                matrix2_value = pre_omic2_dataset.values[
+                    pre_omic2_dataset.index.get_indexer(self._handle_element2)]
+            else:
+                self._handle_element1 = pre_omic1_dataset.index
+                self._handle_element2 = pre_omic2_dataset.index
+                matrix1_value = pre_omic1_dataset.values
+                matrix2_value = matrix1_value if pre_omic2_dataset is pre_omic1_dataset else pre_omic2_dataset.values
+
         self._corr_value = {}
-        self.__cal_cor_value(pre_omic1_dataset.values, pre_omic2_dataset.values)
+        self.__cal_cor_value(matrix1_value, matrix2_value)
         self.__corr_table()
 
         if self._write_out:
@@ -770,8 +1001,8 @@ class Correlation(Preprocessing):
                 table_index = self._handle_element2
             else:
                 table_index = self._handle_element1
-            self._corr_table = pd.DataFrame(np.vstack(
-                list(self._corr_value.values())).T,
+            self._corr_table = pd.DataFrame(
+                np.column_stack([np.ravel(value) for value in self._corr_value.values()]),
                 index=table_index,
                 columns=self._corr_value.keys())
             return self._corr_table
@@ -781,6 +1012,30 @@ class Correlation(Preprocessing):
         return self._corr_table
 
 
+class _OLSFit:
+    '''
+    Minimal stand-in for a fitted smf.ols result when the design matrix is
+    shared across responses: one QR factorization is computed up front and
+    each response only costs two small matmuls against q/rinv
+    '''
+
+    def __init__(self, exog_names, q, rinv, y):
+        qty = q.T @ y
+        params = rinv @ qty
+        resid = y - q @ qty
+        df_resid = y.shape[0] - rinv.shape[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma2 = resid @ resid / df_resid
+            bse = np.sqrt((rinv * rinv).sum(axis=1) * sigma2)
+            tvalues = params / bse
+        self.params = pd.Series(params, index=exog_names)
+        self.bse = pd.Series(bse, index=exog_names)
+        self.tvalues = pd.Series(tvalues, index=exog_names)
+        self.pvalues = pd.Series(
+            2 * scipy.stats.distributions.t.sf(np.abs(tvalues), df_resid),
+            index=exog_names)
+
+
 class Regression(Preprocessing):
     def __init__(self, dirpath=os.getcwd(), type='ols', scaler={}, y=None, x=None, cutoff=None, y_order=None, file_type='category', group_name=None, part_element=None, thresh=None, const=True, categorical='auto', anova=False, output=['params', 'pvalues']):
         super().__init__(dirpath)
@@ -825,19 +1080,60 @@ class Regression(Preprocessing):
             self._reg_x_df = self._reg_x_df.pipe(self.calculate_vif, thresh=self._reg_vif_cutoff)
         self._reg_y_df = self.scale(self._reg_y_df, scaler_y)
 
-        for i in self._reg_y_df.columns:
-            self._reg_df = pd.concat([self._reg_y_df[i].astype(float), self._reg_x_df], axis=1, join='inner').dropna()
+        # detect categorical predictors once; the set is the same for every
+        # response column
+        if self._reg_categorical == 'auto':
+            count = self._reg_x_df.nunique()
+            self._reg_categorical_columns = count.index[count < 8]
+        elif self._reg_categorical:
+            self._reg_categorical_columns = self._reg_categorical
+        else:
+            self._reg_categorical_columns = []
+
+        # align x and y once; the per-y frame is then a column slice instead
+        # of a fresh concat per response
+        x_columns = self._reg_x_df.columns.tolist()
+        reg_xy_df = pd.concat(
+            [self._reg_y_df.astype(float), self._reg_x_df], axis=1, join='inner')
+
+        # when every response shares the same nan pattern the per-y frames
+        # are identical up to the y column, so one QR of the design matrix
+        # serves every ols fit
+        fitted = False
+        y_nan = reg_xy_df[self._reg_y_df.columns].isna().values
+        if (self._reg_type == 'ols' and not self._reg_anova
+                and set(self._reg_output) <= {'params', 'pvalues', 'tvalues', 'bse'}
+                and (y_nan == y_nan[:, :1]).all()):
             try:
-                model = self.__reg_fit(i)
-                self.reg_model[i]['model'] = model
+                self.__reg_fit_ols_shared(reg_xy_df.dropna(), x_columns)
+                fitted = True
             except:
-                print(i)
-            
-            if self._reg_anova:
+                self.reg_model = defaultdict(dict)
+
+        if not fitted:
+            # the per-response fits are independent, so spread them over
+            # threads and gather into reg_model afterwards
+            def _fit_one(i):
+                reg_df = reg_xy_df[[i] + x_columns].dropna()
+                model = anova = None
                 try:
-                    self.reg_model[i]['anova'] = anova_lm(model, typ=2)
+                    model = self.__reg_fit(i, data=reg_df)
                 except:
-                    print('Error in {} variable'.format(i))
+                    print(i)
+                if self._reg_anova and model is not None:
+                    try:
+                        anova = anova_lm(model, typ=2)
+                    except:
+                        print('Error in {} variable'.format(i))
+                return i, model, anova
+
+            results = Parallel(n_jobs=-1, prefer='threads')(
+                delayed(_fit_one)(i) for i in self._reg_y_df.columns)
+            for i, model, anova in results:
+                if model is not None:
+                    self.reg_model[i]['model'] = model
+                if anova is not None:
+                    self.reg_model[i]['anova'] = anova
         self.__reg_table()
 
     def __reg_set_params(self, group_file):
@@ -867,7 +1163,20 @@ class Regression(Preprocessing):
             self._reg_y_df = dropnan(self._reg_y_df, thresh=self._reg_thresh, axis=1)
 
         if self._reg_type == 'logit':
-            self._reg_y_df = pd.get_dummies(self._reg_y_df).iloc[:, range(0, self._reg_y_df.shape[1]*2, 2)]
+            # encode each response against its first category directly,
+            # matching get_dummies' first dummy column without building the
+            # doubled frame and slicing every other column
+            encoded = {}
+            for name, column in self._reg_y_df.items():
+                if hasattr(column, 'cat'):
+                    first = column.cat.categories[0]
+                elif column.dtype == object:
+                    first = np.sort(column.dropna().unique())[0]
+                else:
+                    encoded[name] = column
+                    continue
+                encoded['{}_{}'.format(name, first)] = column.eq(first).astype(np.int8)
+            self._reg_y_df = pd.DataFrame(encoded, index=self._reg_y_df.index)
             self._regressor = smf.logit
         elif self._reg_type == 'ols':
             self._reg_y_df = self._reg_y_df.astype(float)
@@ -875,25 +1184,31 @@ class Regression(Preprocessing):
         elif self._reg_type == 'softmax':
             self._regressor = smf.mnlogit
 
-    def __reg_fit(self, y):
+    def __reg_fit(self, y, data=None):
         formula = "{} ~ {}".format(y, ' + '.join(self._reg_x_df.columns))
         if not self._reg_const:
             formula = formula + '-1'
-        if self._reg_categorical:
-            if self._reg_categorical=='auto':
-                count = self._reg_x_df.apply(lambda x: x.nunique())
-                categorical_columns = count[count<8].index
-            else:
-                categorical_columns = self._reg_categorical
-
-            for categorical_column in categorical_columns:
-                formula = formula.replace(' ' + categorical_column, ' C({}) '.format(categorical_column))
-        model = self._regressor(formula, data=self._reg_df).fit()
+        for categorical_column in self._reg_categorical_columns:
+            formula = formula.replace(' ' + categorical_column, ' C({}) '.format(categorical_column))
+        model = self._regressor(formula, data=data).fit()
         return model
 
+    def __reg_fit_ols_shared(self, data, x_columns):
+        rhs = ' ' + ' + '.join(x_columns)
+        for categorical_column in self._reg_categorical_columns:
+            rhs = rhs.replace(' ' + categorical_column, ' C({}) '.format(categorical_column))
+        if not self._reg_const:
+            rhs = rhs + '-1'
+        design = patsy.dmatrix(rhs, data, return_type='dataframe')
+        q, r = np.linalg.qr(np.asarray(design))
+        rinv = np.linalg.inv(r)
+        for i in self._reg_y_df.columns:
+            self.reg_model[i]['model'] = _OLSFit(
+                design.columns, q, rinv, data[i].values)
+
     def __reg_table(self):
-        self._reg_table = pd.DataFrame()
         outname_mapping = {'params': 'coef'}
+        tables = []
         for output in self._reg_output:
             out_dict = {}
             for name, model in self.reg_model.items():
@@ -910,7 +1225,8 @@ class Regression(Preprocessing):
                 columns = ['model']
             else:
                 columns = None
-            self._reg_table = pd.concat([self._reg_table, pd.DataFrame().from_dict(out_dict, orient='index', columns=columns).rename(columns=lambda x: x+'_{}'.format(outname_mapping.get(output, output)))], axis=1)
+            tables.append(pd.DataFrame.from_dict(out_dict, orient='index', columns=columns).rename(columns=lambda x: x+'_{}'.format(outname_mapping.get(output, output))))
+        self._reg_table = pd.concat(tables, axis=1) if tables else pd.DataFrame()
 
     @property
     def reg_table(self):
@@ -967,6 +1283,8 @@ class Analysis(Group, Correlation, Regression):
             'group_name': self._corr_group_name,
             'part_element': self._corr_part_element,
             'thresh': self._corr_thresh,
+            'device': self._corr_device,
+            'dtype': self._corr_dtype,
             'write_out': self._write_out  # 未解决
         }
         self._group_param_collections = {
@@ -1102,15 +1420,15 @@ class Analysis(Group, Correlation, Regression):
         o = ora(tool)
         self._enrich_tool['ora'] = tool
 
-        out_combine = pd.DataFrame()
+        parts = []
         for annot, qc in query_condition.items():
             enrichment_genes = table.query(
                 qc).index.tolist()
             out = o.run(enrichment_genes, organism=organism,
                        bg=bg, db=db, **kwargs)
             out.insert(0, 'annotation', annot)
-            out_combine = pd.concat([out_combine, out])
-        self.ora = out_combine
+            parts.append(out)
+        self.ora = pd.concat(parts) if parts else pd.DataFrame()
 
     def gsea(self,
              table_type,
@@ -1130,7 +1448,7 @@ class Analysis(Group, Correlation, Regression):
         if table_type == 'group':
             data = self._tmp_dataset.copy()
             cls = self._data[self._file_type].loc[self._tmp_dataset.columns, self._group_name].values.tolist()
-            out_combine = pd.DataFrame()
+            parts = []
             for database in db:
                 gs_res = gp.gsea(
                     data=data,
@@ -1140,7 +1458,8 @@ class Analysis(Group, Correlation, Regression):
                     threads=threads,
                     **kwargs
                 )
-                out_combine = pd.concat([out_combine, gs_res.res2d])
+                parts.append(gs_res.res2d)
+            out_combine = pd.concat(parts)
             out_combine.loc[out_combine[out_combine['NES']>0].index, 'annotation'] = cls[0]
             out_combine['annotation'] = out_combine['annotation'].fillna(cls[-1])
             columns = ['annotation']
@@ -1157,14 +1476,31 @@ class Analysis(Group, Correlation, Regression):
             if query_condition:
                 rnk = rnk.query(query_condition)
 
-            self.gsea_ = pd.DataFrame()
+            parts = []
             for database in db:
                 pre_res = gp.prerank(
                     rnk=rnk,
                     gene_sets=database,
                     threads=threads,
                     **kwargs)
-                self.gsea_ = pd.concat([self.gsea_, pre_res.res2d])
+                parts.append(pre_res.res2d)
+            self.gsea_ = pd.concat(parts)
+
+    def _impute_masked_dataset(self, impute_value):
+        '''
+        count and accumulative both start from the dataset with the imputed
+        placeholder masked to nan; keep the last result since they are
+        typically called back to back on the same grouping
+        '''
+        key = 'min' if isinstance(impute_value, str) else impute_value
+        cached = getattr(self, '_masked_dataset_cache', None)
+        if cached is not None and cached[0] is self._tmp_dataset and cached[1] == key:
+            return cached[2]
+        if isinstance(impute_value, str):
+            impute_value = self._data[self._dataset_type].min()
+        masked = self._tmp_dataset.replace(impute_value, np.nan)
+        self._masked_dataset_cache = (self._tmp_dataset, key, masked)
+        return masked
 
     def count(self,
               impute_value='min',
@@ -1178,16 +1514,13 @@ class Analysis(Group, Correlation, Regression):
               save=None,
               outname=None,
               **kwargs):
-        if impute_value == 'min':
-            impute_value = self._data[self._dataset_type].min()
-
         axis = {'columns': 0, 'rows': 1}.get(axis)
 
         addline_method = {'mean': np.mean,
                           'median': np.median}.get(addline, False)
 
-        plotdata = self._tmp_dataset.replace(
-            impute_value, np.nan).count(axis=axis).rename('count')
+        plotdata = self._impute_masked_dataset(
+            impute_value).count(axis=axis).rename('count')
 
         if self._group_name:
             tmp_value = self._data[self._file_type][self._group_name]
@@ -1216,8 +1549,7 @@ class Analysis(Group, Correlation, Regression):
             if title and not outname:
                 outname = title
 
-            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type=sys._getframe(
-            ).f_code.co_name, out_format=save)
+            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type='count', out_format=save)
         if return_data:
             return plotdata, ax
         else:
@@ -1232,13 +1564,8 @@ class Analysis(Group, Correlation, Regression):
                      save=None,
                      outname=None,
                      **kwargs):
-        if impute_value == 'min':
-            impute_value = self._data[self._dataset_type].min()
-        else:
-            pass
-
-        pre_plotdata = self._tmp_dataset.replace(
-            impute_value, np.nan).applymap(lambda x: 1 if x == x else 0)
+        pre_plotdata = self._impute_masked_dataset(
+            impute_value).notna().astype(np.int8)
 
         # if self._part_element and self._palette:
         #     self._palette = dict(
@@ -1246,8 +1573,7 @@ class Analysis(Group, Correlation, Regression):
         # else:
         #     pass
 
-        plotdata = pre_plotdata.cumsum(axis=axis).applymap(
-            lambda x: 1 if x != 0 else 0).sum()
+        plotdata = pre_plotdata.cumsum(axis=axis).ne(0).astype(np.int8).sum()
 
         if self._group_name:
             tmp_value = self._data[self._file_type][self._group_name]
@@ -1269,8 +1595,7 @@ class Analysis(Group, Correlation, Regression):
                 outname = title
             else:
                 pass
-            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type=sys._getframe(
-            ).f_code.co_name, out_format=save)
+            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type='accumulative', out_format=save)
 
         return ax
 
@@ -1294,7 +1619,7 @@ class Analysis(Group, Correlation, Regression):
             pass
 
         if self._group_name:
-            min_value = np.log10(self._data[self._dataset_type].min().min())
+            min_value = np.log10(self._get_global_min(self._dataset_type))
             plotdata = pd.DataFrame(np.log10(self._Group__param_values[method].T), columns=self._group_values, index=self._tmp_dataset.index).stack().astype('float32').rename_axis(['Symbol', self._group_name]).groupby(
                 self._group_name).apply(lambda x: x.sort_values(ascending=False).rename(ylabel).reset_index()).droplevel(0).set_index('Symbol', append=True).droplevel(0).replace(min_value, np.nan).dropna()
             plotdata = plotdata.groupby('cohort').apply(lambda x: x.reset_index().rename_axis('rank').reset_index().set_index(plotdata.index.name))
@@ -1334,8 +1659,7 @@ class Analysis(Group, Correlation, Regression):
                 outname = title
             else:
                 pass
-            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type=sys._getframe(
-            ).f_code.co_name, out_format=save)
+            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type='range', out_format=save)
 
         return ax
 
@@ -1355,8 +1679,7 @@ class Analysis(Group, Correlation, Regression):
                     outname = title
                 else:
                     pass
-                savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type=sys._getframe(
-                ).f_code.co_name, out_format=save)
+                savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type='overlap', out_format=save)
 
             return ax
 
@@ -1365,15 +1688,16 @@ class Analysis(Group, Correlation, Regression):
             elements = [elements]
         if not data_type:
             data_type = [self._dataset_type]
-        data = self.merge_data_group(elements, data_type=data_type).dropna(how='all', axis=1)
+        data = dropnan_columns(self.merge_data_group(elements, data_type=data_type))
         if len(self._group_name) > 1:
-            data.index = pd.MultiIndex.from_tuples(zip(data.index.get_level_values(0), data.index.map(lambda x: '_'.join(x[1:]))), names=(data.index.names[0], '_'.join(data.index.names[1:])))
+            joined = ['_'.join(group_levels) for group_levels in data.index.droplevel(0)]
+            data.index = pd.MultiIndex.from_arrays([data.index.get_level_values(0), joined], names=(data.index.names[0], '_'.join(data.index.names[1:])))
         
         if (data_type_annot == 'no') or (data_type_annot == 'auto' and len(data_type) == 1):
-            data = data.rename(columns=lambda x: x.split('|')[0])
+            data.columns = data.columns.str.split('|', n=1).str[0]
             elements_loop = elements
         else:
-            elements_loop = list(['|'.join(i) for i in product(elements, data_type)])
+            elements_loop = np.char.add(np.char.add(np.asarray(elements, dtype=str)[:, None], '|'), np.asarray(data_type, dtype=str)[None, :]).ravel().tolist()
         
         if len(elements_loop) == 1:
             order = self._part_element
@@ -1385,14 +1709,27 @@ class Analysis(Group, Correlation, Regression):
             order = elements_loop
             name = ' '
         
-        data = data.stack().swaplevel(1, 2).rename(name).astype(float)
+        data = data.stack().swaplevel(1, 2).rename(name)
+        if data.dtype != np.float64:
+            data = data.astype(float)
         if quantile:
             if isinstance(self._group_name, str):
                 group_name = [self._group_name]
             else:
                 group_name = self._group_name
             groupby_element = '_'.join(group_name)
-            data = data.groupby(groupby_element).apply(lambda x: filter_by_quantile(x)).droplevel(0)
+            grouped = data.groupby(groupby_element)
+            if group_quantile_mask is not None:
+                codes = grouped.ngroup().to_numpy()
+                keep = group_quantile_mask(codes, data.to_numpy(dtype=np.float64), int(codes.max()) + 1, .25, .75)
+                data = data[keep]
+            else:
+                # broadcast the per-group quantiles with transform and mask once
+                # instead of calling filter_by_quantile per group through apply
+                q1 = grouped.transform('quantile', .25)
+                q3 = grouped.transform('quantile', .75)
+                iqr = q3 - q1
+                data = data[(data >= q1 - 1.5 * iqr) & (data <= q3 + 1.5 * iqr)]
         
         if not title:
             title = name
@@ -1410,10 +1747,11 @@ class Analysis(Group, Correlation, Regression):
             axs = cateplot(data, hue=hue, order=order, **params, **kwargs)
         else:
             axs = []
-            for element in elements_loop:    
-                tmp_data = data.xs(element, axis=0, level=1, drop_level=False).rename(element)
+            # one grouped pass slices every element at C level instead of a
+            # fresh MultiIndex cross-section per plot
+            for element, tmp_data in data.groupby(level=1, sort=False):
                 params['title'] = element
-                axs.append(cateplot(tmp_data, order=order,
+                axs.append(cateplot(tmp_data.rename(element), order=order,
                           hue=hue, **params, **kwargs))
 
         if save:
@@ -1421,8 +1759,7 @@ class Analysis(Group, Correlation, Regression):
                 outname = title
             else:
                 pass
-            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type=sys._getframe(
-            ).f_code.co_name, out_format=save)
+            savefig(ax, outpath=os.path.join(self._dirpath, 'figure'), outname=outname, plot_type='cate', out_format=save)
         if return_data:
             return data, axs
         else:
@@ -1441,59 +1778,80 @@ class Analysis(Group, Correlation, Regression):
 
         if annot_dict:
             tmp_columns = plotdata.columns.str.split('|', expand=True).get_level_values(0)
-            plotdata.columns = pd.MultiIndex.from_arrays(np.vstack((tmp_columns, [tmp_columns.map(v) for k, v in annot_dict.items()])), names=np.hstack(('Genes', list(annot_dict.keys()))))
+            plotdata.columns = pd.MultiIndex.from_arrays([tmp_columns] + [tmp_columns.map(v) for v in annot_dict.values()], names=['Genes'] + list(annot_dict.keys()))
 
         remove = False
         if (data_type_annot == 'no') or (data_type_annot == 'auto' and len(data_type) == 1):
             remove = True
         if remove:
-            plotdata = plotdata.rename(columns=lambda x: x.split('|')[0], level=0)
+            if isinstance(plotdata.columns, pd.MultiIndex):
+                plotdata.columns = plotdata.columns.set_levels(plotdata.columns.levels[0].str.split('|', n=1).str[0], level=0)
+            else:
+                plotdata.columns = plotdata.columns.str.split('|', n=1).str[0]
 
         if len(group_name) > 1:
-            plotdata_index_element = dict(zip(plotdata.index.names[1:], [i.values for i in plotdata.droplevel(0).index.levels]))
-            lut_default = {i: {k: v for k, v in j.items() if k in plotdata_index_element[i]} for i, j in self._color_map.items() if i in group_name}
+            plotdata_index_element = {name: set(level.values) for name, level in zip(plotdata.index.names[1:], plotdata.droplevel(0).index.levels)}
+            lut_default = {i: {k: v for k, v in j.items() if k in plotdata_index_element[i]} for i, j in self._color_map.items() if i in group_name and i in plotdata_index_element}
         else:
-            lut_default = {i: {k: v for k, v in j.items() if k in self._part_element} for i, j in self._color_map.items() if i in group_name}
+            part_element = set(self._part_element)
+            lut_default = {i: {k: v for k, v in j.items() if k in part_element} for i, j in self._color_map.items() if i in group_name}
 
         if lut:
             lut_default.update(lut)
         
         if 'col_cluster' in kwargs.keys() or 'row_cluster' in kwargs.keys():
             plotdata = plotdata.fillna(1e-5)
-        
-        if any([kwargs.get('col_cluster', None), kwargs.get('row_cluster', None)]):
-                plotdata = plotdata.fillna(1e-5)
 
         ax = heatmap(plotdata.T, lut=lut_default, z_score=z_score, **kwargs)
         if return_data:
             return plotdata, ax
         return ax
 
+    @property
+    def _element_index(self):
+        '''
+        Column -> series lookup over the statistic tables, rebuilt only
+        when one of the tables is replaced
+        '''
+        table_names = ('_group_table', '_corr_table', '_reg_table')
+        # keep the table objects themselves in the cache entry: identity
+        # checks on bare id()s can false-match once an old table is freed
+        # and its address reused
+        tables = tuple(self.__dict__.get(name) for name in table_names)
+        cached = getattr(self, '_element_index_cache', None)
+        if cached is not None and all(
+                cached_table is table for cached_table, table in zip(cached[0], tables)):
+            return cached[1]
+        element_index = {}
+        for table in tables:
+            if table is not None:
+                for column in table.columns:
+                    element_index[column] = table[column]
+        self._element_index_cache = (tables, element_index)
+        return element_index
+
     def scatter(self, elements, volcano=False, sig_log_transform=True, hue=None, size=None, highlight_points=None, palette=None, ax=None, figsize=(1.8, 1.8), title=None, adjust_axes=True, ticklabels_hide=[], ticklabels_format=['y'], ticklabels_wrap=[], wrap_length=None, spines_hide=[], labels_hide=[], return_data=True, **kwargs):
-        series_list = []
-        for table_name in ['_group_table', '_corr_table', '_reg_table']:
-            if hasattr(self, table_name):
-                add_new = [self.__dict__[table_name][element] for element in elements if element in self.__dict__[table_name].columns]
-                series_list.extend(add_new)
-        table = pd.concat(series_list, axis=1, join='inner').reindex(elements, axis=1).dropna(how='all', axis=1)
+        element_index = self._element_index
+        series_list = [element_index[element] for element in elements if element in element_index]
+        table = dropnan_columns(_concat_series_inner(series_list).reindex(elements, axis=1))
         if len(elements) == 3:
             table = table.iloc[:, [0, 2, 1]]
 
         columns_shape = table.columns.shape[0]
         if table.columns.nunique() != columns_shape:
+            renamed_columns = list(table.columns)
             if columns_shape > 2:
-                rename_column = table.columns[2]
-                table = pd.concat([table.iloc[:, :2], table.iloc[:, 2:].rename(columns={rename_column: rename_column+'_hue'})], axis=1)
+                renamed_columns[2] += '_hue'
             if columns_shape > 3:
-                rename_column = table.columns[3]
-                table = pd.concat([table.iloc[:, :3], table.iloc[:, 3:].rename(columns={rename_column: rename_column+'_size'})], axis=1)
+                renamed_columns[3] += '_size'
+            table.columns = renamed_columns
 
         if volcano:
             sig_up_color, sig_down_color = self._palette[self._dividend], self._palette[self._divisor]
             if not title:
                 title = '{} vs. {}'.format(self._dividend, self._divisor)
             if isinstance(highlight_points, dict):
-                highlight_points = np.unique(np.hstack(self.get_gene_from_enrichment(highlight_points).values())).tolist()
+                highlight_points = sorted(set().union(*self.get_gene_from_enrichment(highlight_points).values()))
             
             out_ = volcanoplot(table, title=title, sig_up_color=sig_up_color, sig_down_color=sig_down_color, highlight_points=highlight_points, adjust_axes=adjust_axes, ticklabels_hide=ticklabels_hide, ticklabels_format=ticklabels_format, ticklabels_wrap=ticklabels_wrap, wrap_length=wrap_length, spines_hide=spines_hide, labels_hide=labels_hide, ax=ax, figsize=figsize, return_data=return_data, **kwargs)
             if return_data:
@@ -1503,8 +1861,12 @@ class Analysis(Group, Correlation, Regression):
         else:
             if sig_log_transform:
                 if not isinstance(sig_log_transform, Iterable):
-                    sig_log_transform = table.filter(regex="pvalues|fdr").columns
-                table[sig_log_transform] = -np.log10(table[sig_log_transform])
+                    sig_log_transform = [column for column in table.columns
+                                         if _SIG_COLUMNS_PATTERN.search(column)]
+                arr = table[sig_log_transform].to_numpy(dtype=np.float64, copy=True)
+                np.log10(arr, out=arr)
+                np.negative(arr, out=arr)
+                table[sig_log_transform] = arr
                 def rename_columns(x):
                     if x in sig_log_transform:
                         x = '-Log10({})'.format(x)
@@ -1525,10 +1887,11 @@ class Analysis(Group, Correlation, Regression):
                     k, v = list(hue.items())[0]
                     v = self.get_gene_from_enrichment(v)
 
-                for k1, v1 in v.items():
-                    gene = np.intersect1d(table.index, v1)
-                    table.loc[gene, k] = k1
-                table[k] = table[k].fillna('')
+                # invert the category lists once and resolve every gene with
+                # a single hashed map pass; later categories still win ties
+                mapping = {gene: k1 for k1, v1 in v.items() for gene in v1}
+                table[k] = pd.Series(
+                    table.index.map(mapping), index=table.index).fillna('')
                 if size:
                     if size == 'hue':
                         table.loc[:, 'size'] = table[k].apply(lambda x: 'annot' if x!='' else x)
@@ -1544,7 +1907,7 @@ class Analysis(Group, Correlation, Regression):
                 table = table.sort_values(k, ascending=True)
             
             if highlight_points == 'hue':
-                highlight_points = np.hstack(list(v.values())).tolist()
+                highlight_points = list(chain.from_iterable(v.values()))
             
             ax = scatterplot(table, title=title, palette=palette, highlight_points=highlight_points, adjust_axes=adjust_axes, ticklabels_hide=ticklabels_hide, ticklabels_format=ticklabels_format, ticklabels_wrap=ticklabels_wrap, wrap_length=wrap_length, spines_hide=spines_hide, labels_hide=labels_hide, ax=ax, figsize=figsize, **kwargs)
         if return_data:
@@ -1554,20 +1917,28 @@ class Analysis(Group, Correlation, Regression):
 
     def bubble(self, elements, query_condition=None, sort=None, ascending=True, sig_log_transform=True, highlight_points=None, palette=R_CMAP, ax=None, figsize=(1.8, 1.8), title=None, adjust_axes=True, ticklabels_hide=[], ticklabels_format=[], ticklabels_wrap=[], wrap_length=None, spines_hide=[], labels_hide=[], **kwargs):
         table_name, elements = list(elements.items())[0]
-        series_list = [self.__dict__[table_name][element] for element in elements if element in self.__dict__[table_name].columns]
-        table = pd.concat(series_list, axis=1, join='inner')[elements]
+        source_table = self.__dict__[table_name]
+        source_columns = set(source_table.columns)
+        series_list = [source_table[element] for element in elements if element in source_columns]
+        table = _concat_series_inner(series_list)[elements]
         if len(elements) == 3:
             table = table.iloc[:, [0, 2, 1]]
 
         if query_condition:
             table = table.query(query_condition)
         if sort:
-            table = table.groupby(elements[0], as_index=False).apply(lambda x: x.sort_values(by=sort, ascending=ascending)).reset_index(drop=True)
+            sort_keys = [elements[0]] + ([sort] if isinstance(sort, str) else list(sort))
+            sort_ascending = [True] + ([ascending] * (len(sort_keys) - 1) if isinstance(ascending, bool) else list(ascending))
+            table = table.sort_values(by=sort_keys, ascending=sort_ascending).reset_index(drop=True)
             
         if sig_log_transform:
             if not isinstance(sig_log_transform, Iterable):
-                sig_log_transform = table.filter(regex="pvalue|fdr|FDR|qvalue|adjust|p-val|p_value").columns
-            table[sig_log_transform] = -np.log10(table[sig_log_transform].astype(float))
+                sig_log_transform = [column for column in table.columns
+                                     if _BUBBLE_SIG_COLUMNS_PATTERN.search(column)]
+            arr = table[sig_log_transform].to_numpy(dtype=np.float64, copy=True)
+            np.log10(arr, out=arr)
+            np.negative(arr, out=arr)
+            table[sig_log_transform] = arr
             def rename_columns(x):
                 if x in sig_log_transform:
                     x = '-Log10({})'.format(x)
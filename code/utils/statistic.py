@@ -1,7 +1,24 @@
 import numpy as np
 import scipy.stats
+from joblib import Parallel, delayed, effective_n_jobs
 from scipy.stats._stats_py import _chk_asarray
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import cupy
+except ImportError:
+    cupy = None
+
+try:
+    import bottleneck as bn
+    nanmean, nanmedian, nanstd, nansum = bn.nanmean, bn.nanmedian, bn.nanstd, bn.nansum
+except ImportError:
+    nanmean, nanmedian, nanstd, nansum = np.nanmean, np.nanmedian, np.nanstd, np.nansum
+
 
 def fdr(pvals, method='indep'):
     '''
@@ -38,6 +55,60 @@ def fdr(pvals, method='indep'):
         return fdr_out
 
 
+def fdr_vectorized(pvals, method='indep', axis=-1):
+    '''
+    Batched Benjamini/Hochberg (or Benjamini/Yekutieli for 'n'/'negcorr')
+    correction along an axis: one argsort for the whole array instead of a
+    python call per p-value vector. NaNs are skipped and kept in place,
+    mirroring fdr; returns the adjusted p-values only.
+    '''
+    p = np.asarray(pvals, dtype=np.float64)
+    one_dim = p.ndim == 1
+    if one_dim:
+        p = p[None, :]
+        axis = -1
+    p = np.moveaxis(p, axis, -1)
+    k = p.shape[-1]
+    nan_mask = np.isnan(p)
+    n_valid = (~nan_mask).sum(axis=-1, keepdims=True)
+    order = np.argsort(np.where(nan_mask, np.inf, p), axis=-1)
+    ranked = np.take_along_axis(p, order, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = n_valid / np.arange(1, k + 1)
+        if method in ('n', 'negcorr'):
+            harmonic = np.cumsum(1.0 / np.arange(1, k + 1))
+            factor = factor * harmonic[np.clip(n_valid - 1, 0, k - 1)]
+        adjusted = ranked * factor
+    adjusted[np.take_along_axis(nan_mask, order, axis=-1)] = np.nan
+    adjusted = np.fmin.accumulate(adjusted[..., ::-1], axis=-1)[..., ::-1]
+    adjusted = np.clip(adjusted, None, 1.0)
+    out = np.empty_like(adjusted)
+    np.put_along_axis(out, order, adjusted, axis=-1)
+    out = np.moveaxis(out, -1, axis)
+    if one_dim:
+        out = out[0]
+    return out
+
+
+def parallel_rows(func, samples, n_jobs=-1):
+    '''
+    Run a per-row scipy test over feature chunks in threads: each group in
+    samples is split along axis=0, func(*groups) is called per chunk under
+    joblib (scipy releases the GIL inside these tests), and the chunk
+    statistic/pvalue arrays are concatenated back.
+    '''
+    n_chunks = min(effective_n_jobs(n_jobs), samples[0].shape[0])
+    if n_chunks <= 1:
+        results = [func(*samples)]
+    else:
+        splits = [np.array_split(sample, n_chunks) for sample in samples]
+        results = Parallel(n_jobs=n_chunks, prefer='threads')(
+            delayed(func)(*groups) for groups in zip(*splits))
+    statistic = np.concatenate([np.atleast_1d(res.statistic) for res in results])
+    pvalue = np.concatenate([np.atleast_1d(res.pvalue) for res in results])
+    return statistic, pvalue
+
+
 def obtain_ranked(a):
     if np.all(np.isnan(a)):
         ranked = scipy.stats.rankdata(a, axis=1, nan_policy='omit')
@@ -85,7 +156,7 @@ def chk_asarray(a, axis):
 
 def square_of_sums(a, axis=0):
     a, axis = _chk_asarray(a, axis)
-    s = np.nansum(a, axis)
+    s = nansum(a, axis)
     if not np.isscalar(s):
         return s.astype(float) * s
     else:
@@ -94,7 +165,7 @@ def square_of_sums(a, axis=0):
 
 def sum_of_squares(a, axis=0):
     a, axis = _chk_asarray(a, axis)
-    return np.nansum(a*a, axis)
+    return nansum(a*a, axis)
 
 
 def ranksums_vectorized(x, y):
@@ -113,7 +184,7 @@ def ranksums_vectorized(x, y):
         mask[mask != mask] = 0
         ranked = scipy.stats.rankdata(alldata, axis=1, nan_policy='omit') * mask
     x = ranked[:, :n1]
-    s = np.nansum(x, axis=1)
+    s = nansum(x, axis=1)
     expected = masked_n1 * (masked_n1 + masked_n2 + 1) / 2.0
     statistic = (s - expected) / np.sqrt(masked_n1 *
                                          masked_n2 * (masked_n1 + masked_n2 + 1) / 12.0)
@@ -122,6 +193,148 @@ def ranksums_vectorized(x, y):
     return statistic, pvalue
 
 
+if numba is not None:
+    # no fastmath: its nnan flag would fold the v == v NaN guard away
+    @numba.njit(parallel=True, cache=True)
+    def group_stats_kernel(X, labels, n_groups):
+        n_features, n_samples = X.shape
+        count = np.zeros((n_groups, n_features))
+        mean = np.full((n_groups, n_features), np.nan)
+        std = np.full((n_groups, n_features), np.nan)
+        for f in numba.prange(n_features):
+            cnt = np.zeros(n_groups)
+            value_sum = np.zeros(n_groups)
+            square_sum = np.zeros(n_groups)
+            for s in range(n_samples):
+                g = labels[s]
+                if g < 0:
+                    continue
+                v = X[f, s]
+                if v == v:
+                    cnt[g] += 1.0
+                    value_sum[g] += v
+                    square_sum[g] += v * v
+            for g in range(n_groups):
+                count[g, f] = cnt[g]
+                if cnt[g] > 0.0:
+                    m = value_sum[g] / cnt[g]
+                    mean[g, f] = m
+                    if cnt[g] > 1.0:
+                        var = (square_sum[g] - value_sum[g] * m) / (cnt[g] - 1.0)
+                        if var < 0.0:
+                            var = 0.0
+                        std[g, f] = np.sqrt(var)
+        return count, mean, std
+    # no fastmath here either: the a == a / b == b pair check must survive
+    @numba.njit(parallel=True, cache=True)
+    def pairwise_pearson_nan(A, B):
+        n1 = A.shape[0]
+        n2 = B.shape[0]
+        n_samples = A.shape[1]
+        corr = np.full((n1, n2), np.nan)
+        count = np.zeros((n1, n2))
+        for i in numba.prange(n1):
+            for j in range(n2):
+                n = 0.0
+                sum_a = 0.0
+                sum_b = 0.0
+                square_sum_a = 0.0
+                square_sum_b = 0.0
+                cross_sum = 0.0
+                for k in range(n_samples):
+                    a = A[i, k]
+                    b = B[j, k]
+                    if a == a and b == b:
+                        n += 1.0
+                        sum_a += a
+                        sum_b += b
+                        square_sum_a += a * a
+                        square_sum_b += b * b
+                        cross_sum += a * b
+                count[i, j] = n
+                if n > 1.0:
+                    cov = cross_sum - sum_a * sum_b / n
+                    var_a = square_sum_a - sum_a * sum_a / n
+                    var_b = square_sum_b - sum_b * sum_b / n
+                    denom = np.sqrt(var_a * var_b)
+                    if denom > 0.0:
+                        corr[i, j] = cov / denom
+        return corr, count
+    @numba.njit(parallel=True, cache=True)
+    def group_quantile_mask(codes, values, n_groups, bottom, up):
+        '''
+        Per-group IQR fences in one compiled pass; keeps the rows
+        filter_by_quantile would keep when applied group by group
+        '''
+        n = values.shape[0]
+        counts = np.zeros(n_groups, dtype=np.int64)
+        for i in range(n):
+            if codes[i] >= 0 and values[i] == values[i]:
+                counts[codes[i]] += 1
+        offsets = np.zeros(n_groups + 1, dtype=np.int64)
+        for g in range(n_groups):
+            offsets[g + 1] = offsets[g] + counts[g]
+        cursor = offsets[:n_groups].copy()
+        flat = np.empty(offsets[n_groups])
+        for i in range(n):
+            g = codes[i]
+            if g >= 0 and values[i] == values[i]:
+                flat[cursor[g]] = values[i]
+                cursor[g] += 1
+        low = np.full(n_groups, np.nan)
+        high = np.full(n_groups, np.nan)
+        for g in numba.prange(n_groups):
+            m = counts[g]
+            if m == 0:
+                continue
+            seg = np.sort(flat[offsets[g]:offsets[g + 1]])
+            fences = np.empty(2)
+            for k, q in enumerate((bottom, up)):
+                loc = q * (m - 1)
+                left = int(loc)
+                if left + 1 < m:
+                    fences[k] = seg[left] + (seg[left + 1] - seg[left]) * (loc - left)
+                else:
+                    fences[k] = seg[left]
+            iqr = fences[1] - fences[0]
+            low[g] = fences[0] - 1.5 * iqr
+            high[g] = fences[1] + 1.5 * iqr
+        keep = np.zeros(n, dtype=np.bool_)
+        for i in range(n):
+            g = codes[i]
+            v = values[i]
+            if g >= 0 and v == v and v >= low[g] and v <= high[g]:
+                keep[i] = True
+        return keep
+else:
+    group_stats_kernel = None
+    pairwise_pearson_nan = None
+    group_quantile_mask = None
+
+
+def ttest_ind_vectorized(x, y, mask_x=None, mask_y=None):
+    if mask_x is None:
+        mask_x = ~np.isnan(x)
+    if mask_y is None:
+        mask_y = ~np.isnan(y)
+    n1 = mask_x.sum(axis=1)
+    n2 = mask_y.sum(axis=1)
+    sum1 = np.where(mask_x, x, 0).sum(axis=1)
+    sum2 = np.where(mask_y, y, 0).sum(axis=1)
+    square_sum1 = np.where(mask_x, x * x, 0).sum(axis=1)
+    square_sum2 = np.where(mask_y, y * y, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = sum1 / n1
+        mean2 = sum2 / n2
+        var1 = (square_sum1 - sum1 * mean1) / (n1 - 1)
+        var2 = (square_sum2 - sum2 * mean2) / (n2 - 1)
+        df = n1 + n2 - 2
+        pooled_var = ((n1 - 1) * var1 + (n2 - 1) * var2) / df
+        statistic = (mean1 - mean2) / np.sqrt(pooled_var * (1.0 / n1 + 1.0 / n2))
+    pvalue = 2 * scipy.special.stdtr(df, -np.abs(statistic))
+    return statistic, pvalue
+
+
 def kruskal_vectorized(a):
     n = np.asarray(list(map(lambda x: len(x[0]), a)))
     num_groups = len(a)
@@ -149,39 +362,36 @@ def kruskal_vectorized(a):
 def f_oneway_vectorized(*samples, axis=0):
     samples = [np.asarray(sample, dtype=float) for sample in samples]
     num_groups = len(samples)
-    alldata = np.concatenate(samples, axis=axis)
-    bign = np.sum(~np.isnan(alldata), axis=axis)
-    # print('bign', bign)
-    offset = np.nanmean(alldata, axis=axis, keepdims=True)
-    alldata -= offset
-
-    normalized_ss = square_of_sums(alldata, axis=axis) / bign
-    # print('normalized_ss', normalized_ss)
-    sstot = sum_of_squares(alldata, axis=axis) - normalized_ss
-    ssbn = 0
-    for sample in samples:
-        ssbn += square_of_sums(sample - offset,
-                                axis=axis) / np.sum(~np.isnan(sample), axis=axis)
-
-    from scipy import special
-    ssbn -= normalized_ss
-    sswn = sstot - ssbn
-    dfbn = num_groups - 1
-    dfwn = bign - num_groups
-    # print('dfwn', dfwn)
-    msb = ssbn / dfbn
-    msw = sswn / dfwn
+    masks = [~np.isnan(sample) for sample in samples]
+    counts = [mask.sum(axis=axis) for mask in masks]
+    bign = sum(counts)
     with np.errstate(divide='ignore', invalid='ignore'):
-        f = msb / msw
-
-    prob = special.fdtrc(dfbn, dfwn, f)   # equivalent to stats.f.sf
+        total_sum = sum(np.where(mask, sample, 0).sum(axis=axis)
+                        for sample, mask in zip(samples, masks))
+        # centering on the grand mean makes the per-group reductions below
+        # yield SS_between and SS_total directly
+        offset = np.expand_dims(total_sum / bign, axis)
+        ssbn = 0
+        sstot = 0
+        for sample, mask, n in zip(samples, masks, counts):
+            centered = np.where(mask, sample - offset, 0)
+            group_sum = centered.sum(axis=axis)
+            ssbn += group_sum * group_sum / n
+            sstot += (centered * centered).sum(axis=axis)
+        sswn = sstot - ssbn
+        dfbn = num_groups - 1
+        dfwn = bign - num_groups
+        f = (ssbn / dfbn) / (sswn / dfwn)
+
+    prob = scipy.special.fdtrc(dfbn, dfwn, f)   # equivalent to stats.f.sf
     return f, prob
 
 
-def core_corr_tensor(A, B, method='spearman'):
+def core_corr_tensor(A, B, method='spearman', ranked=False, device='cpu'):
     if method == 'spearman':
-        A = obtain_ranked(A)
-        B = obtain_ranked(B)
+        if not ranked:
+            A = obtain_ranked(A)
+            B = obtain_ranked(B)
         dof = np.count_nonzero(~np.isnan(A), axis=1) - 2
     elif method == 'pearson':
         dof = np.count_nonzero(~np.isnan(A), axis=1) / 2 -1
@@ -189,10 +399,16 @@ def core_corr_tensor(A, B, method='spearman'):
     A_mA = A - A.mean(1)[:, None]
     B_mB = B - B.mean(1)[:, None]
 
-    # Sum of squares across rows
-    ssA = (A_mA**2).sum(1)
-    ssB = (B_mB**2).sum(1)
-    corr = np.dot(A_mA, B_mB.T) / np.sqrt(np.dot(ssA[:, None], ssB[None]))
+    # normalizing each row by its norm first makes the GEMM output the
+    # correlation directly, instead of dividing by an N1 x N2 sqrt outer
+    # product afterwards
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A_mA /= np.sqrt((A_mA**2).sum(1))[:, None]
+        B_mB /= np.sqrt((B_mB**2).sum(1))[:, None]
+    if device != 'cpu' and cupy is not None:
+        corr = cupy.asnumpy(cupy.asarray(A_mA) @ cupy.asarray(B_mB).T)
+    else:
+        corr = np.dot(A_mA, B_mB.T)
     return np.unique(dof), corr
 
 
@@ -213,12 +429,12 @@ def core_corr(a, b, method='spearman'):
         dof = np.count_nonzero(~np.isnan(a), axis=1) / 2 -1
     else:
         raise ValueError('core_corr function only support spearman and pearson, please check your method parameter.')
-    A_mA = A - np.nanmean(A,1)[:, None]
-    B_mB = B - np.nanmean(B,1)[:, None]
+    A_mA = A - nanmean(A, 1)[:, None]
+    B_mB = B - nanmean(B, 1)[:, None]
 
-    ssA = np.nansum(A_mA**2, axis=1)
-    ssB = np.nansum(B_mB**2, axis=1)
-    corr = np.nansum(A_mA * B_mB, 1)[None, :] / np.sqrt((ssA * ssB)[None, :])
+    ssA = nansum(A_mA**2, axis=1)
+    ssB = nansum(B_mB**2, axis=1)
+    corr = nansum(A_mA * B_mB, 1)[None, :] / np.sqrt((ssA * ssB)[None, :])
     count = np.count_nonzero(~np.isnan(a), axis=1)
     return count, dof, corr
 